@@ -2,9 +2,15 @@ from flask import Flask
 from src.endpoints import home
 from json import JSONEncoder
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    # Set PROFILING to True to sample requests with cProfile and log slow SQL, see src/profiling.py
+    app.config['PROFILING'] = False
+    # Set FIRST_AVAILABLE_WORKERS to search first_available across that many worker processes, see src/sharding.py
+    app.config['FIRST_AVAILABLE_WORKERS'] = 0
+    if config:
+        app.config.update(config)
     from src.extensions import db
     db.init_app(app)
          
@@ -12,7 +18,13 @@ def create_app():
     # restart wipes the db clean, but does have the advantage of not having to worry about schema migrations.
     db.create_all(app=app)
     app.register_blueprint(home)
+    if app.config['PROFILING']:
+        from src.profiling import Profiler
+        Profiler(app)
     from src.seed import seed_data
     with app.app_context():
         seed_data()
+    if app.config['FIRST_AVAILABLE_WORKERS']:
+        from src.sharding import ShardedFirstAvailable
+        ShardedFirstAvailable(app)
     return app
@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, make_response
+from flask import Blueprint, current_app, jsonify, request, make_response
 from http import HTTPStatus
 import json
 from src.extensions import db
@@ -69,6 +69,9 @@ def appointment_model_create(provider_name, start_time, end_time, first_name, la
         last_name=last_name)
     db.session.add(new_record)
     db.session.commit()
+    first_available_pool = current_app.extensions.get('first_available_pool')
+    if first_available_pool is not None:
+        first_available_pool.book(provider.id, provider.last_name, start_time, end_time)
     return jsonify(None), HTTPStatus.OK
 
 
@@ -92,7 +95,11 @@ def appointments(provider_name, start_time, end_time):
 @use_kwargs(first_available_args, location="query")
 def first_available(start_time, duration):
     print("first_available: ", start_time, duration)
-    first_available = AppointmentModel.firstAvailable(start_time, duration)
+    first_available_pool = current_app.extensions.get('first_available_pool')
+    if first_available_pool is not None:
+        first_available = first_available_pool.firstAvailable(start_time, duration)
+    else:
+        first_available = AppointmentModel.firstAvailable(start_time, duration)
     print('first_available: ', first_available)
     return make_response(jsonify(first_available), HTTPStatus.OK)
 
@@ -0,0 +1,273 @@
+"""
+Concurrent HTTP load generator.
+
+Starts the app under a real threaded WSGI server on localhost and drives it from many concurrent workers with a mix
+of booking, listing and first_available requests. Run from the api-skeleton directory, for example:
+
+    python -m src.loadtest --profile booking-storm --workers 32 --requests 2000 --providers 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as time_of_day, timedelta
+from http import HTTPStatus
+from typing import Dict, List
+
+from sqlalchemy.orm import aliased
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from src.app import create_app
+from src.extensions import db
+from src.models import AppointmentModel, AvailabilityModel, ProviderModel
+
+
+# Relative weights of each operation, keyed by profile name.
+PROFILES = {
+    'read-heavy': {'appointments': 80, 'first_available': 10, 'book': 10},
+    'booking-storm': {'book': 90, 'appointments': 10},
+    'first-available-spike': {'first_available': 80, 'book': 10, 'appointments': 10},
+    'mixed': {'book': 40, 'appointments': 40, 'first_available': 20},
+}
+
+# Generated requests fall on weekdays in the `days` days starting Monday 2023-01-02.
+FIRST_DAY = datetime(2023, 1, 2)
+OPENING_TIME = time_of_day(9, 0, 0)
+CLOSING_TIME = time_of_day(17, 0, 0)
+DURATIONS_IN_MINUTES = [20, 45, 60]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def seed_providers(count: int) -> List[str]:
+    """
+    Adds `count` providers that are available 9am-5pm Monday to Friday.
+
+    :return: The names of the seeded providers
+    """
+    names = []
+    for index in range(count):
+        provider = ProviderModel(last_name='load_{}'.format(index))
+        db.session.add(provider)
+        db.session.flush()
+        for day_of_week in range(1, 6):
+            db.session.add(AvailabilityModel(provider_id=provider.id, day_of_week=day_of_week,
+                                             start_time=OPENING_TIME, end_time=CLOSING_TIME))
+        names.append(provider.last_name)
+    db.session.commit()
+    return names
+
+
+def double_bookings() -> List[Dict]:
+    """
+    :return: Every pair of appointments for the same provider whose times overlap
+    """
+    other = aliased(AppointmentModel)
+    overlapping = db.session.query(AppointmentModel, other) \
+        .filter(AppointmentModel.provider_id == other.provider_id) \
+        .filter(AppointmentModel.id < other.id) \
+        .filter(AppointmentModel.start_time < other.end_time) \
+        .filter(other.start_time < AppointmentModel.end_time) \
+        .all()
+    return [{'first': first.serialize(), 'second': second.serialize()} for first, second in overlapping]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, provider_names: List[str], profile: Dict[str, int], days: int, seed: int = None):
+        self.base_url = base_url
+        self.provider_names = provider_names
+        self.operations = list(profile.keys())
+        self.weights = list(profile.values())
+        self.days = days
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def _random_slot(self, rng: random.Random):
+        # Slots are on the hour so a booking storm keeps colliding on the same few start times.
+        day = FIRST_DAY + timedelta(days=rng.randrange(self.days))
+        while day.weekday() >= 5:
+            day = FIRST_DAY + timedelta(days=rng.randrange(self.days))
+        start_time = day.replace(hour=rng.randrange(OPENING_TIME.hour, CLOSING_TIME.hour))
+        return start_time, rng.choice(DURATIONS_IN_MINUTES)
+
+    def _request(self, rng: random.Random, operation: str) -> urllib.request.Request:
+        start_time, duration = self._random_slot(rng)
+        if operation == 'book':
+            body = {'provider_name': rng.choice(self.provider_names),
+                    'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'end_time': (start_time + timedelta(minutes=duration)).strftime('%Y-%m-%d %H:%M:%S'),
+                    'first_name': 'load',
+                    'last_name': 'test'}
+            return urllib.request.Request(self.base_url + '/appointment_model', data=json.dumps(body).encode(),
+                                          headers={'Content-Type': 'application/json'}, method='POST')
+        if operation == 'appointments':
+            query = {'provider_name': rng.choice(self.provider_names),
+                     'start_time': start_time.replace(hour=0).strftime('%Y-%m-%d %H:%M:%S'),
+                     'end_time': (start_time.replace(hour=0) + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')}
+            return urllib.request.Request(self.base_url + '/appointment_model/appointments?' +
+                                          urllib.parse.urlencode(query))
+        query = {'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'), 'duration': duration}
+        return urllib.request.Request(self.base_url + '/appointment_model/first_available?' +
+                                      urllib.parse.urlencode(query))
+
+    def _send(self, request_seed: int):
+        rng = random.Random(request_seed)
+        operation = rng.choices(self.operations, weights=self.weights)[0]
+        request = self._request(rng, operation)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as err:
+            status = err.code
+        except (urllib.error.URLError, OSError):
+            status = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latencies[operation].append(elapsed_ms)
+            self.statuses[operation][status] += 1
+
+    def run(self, workers: int, requests: int) -> float:
+        """
+        Sends `requests` requests from `workers` concurrent workers.
+
+        :return: Wall clock seconds taken
+        """
+        seeds = [self.random.getrandbits(32) for _ in range(requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self._send, seeds))
+        return time.perf_counter() - start
+
+    def report(self, elapsed_seconds: float) -> Dict:
+        operations = {}
+        total = 0
+        total_errors = 0
+        for operation, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            statuses = self.statuses[operation]
+            count = len(latencies)
+            # A 403 on a booking means the slot was taken, that is a conflict. Any other non 2xx is an error.
+            conflicts = statuses[HTTPStatus.FORBIDDEN] if operation == 'book' else 0
+            errors = sum(n for status, n in statuses.items()
+                         if status is None or not 200 <= status < 300) - conflicts
+            total += count
+            total_errors += errors
+            operations[operation] = {
+                'requests': count,
+                'throughput_rps': round(count / elapsed_seconds, 2),
+                'latency_ms': {'p50': round(percentile(latencies, 0.50), 3),
+                               'p90': round(percentile(latencies, 0.90), 3),
+                               'p99': round(percentile(latencies, 0.99), 3),
+                               'max': round(latencies[-1], 3)},
+                'error_rate': round(errors / count, 4),
+                'conflict_rate': round(conflicts / count, 4),
+                'statuses': {str(status): n for status, n in statuses.items()},
+            }
+        return {'elapsed_seconds': round(elapsed_seconds, 3),
+                'requests': total,
+                'throughput_rps': round(total / elapsed_seconds, 2),
+                'error_rate': round(total_errors / total, 4) if total else 0.0,
+                'operations': operations}
+
+
+def run_load_test(profile: str = 'mixed', workers: int = 16, requests: int = 1000, providers: int = 20,
+                  days: int = 5, database_uri: str = None, seed: int = None, verbose: bool = False,
+                  first_available_workers: int = 0) -> Dict:
+    """
+    Starts the app on a free local port, runs the workload and checks for double bookings afterwards.
+
+    By default a temporary file-backed SQLite database is used so each server thread gets its own connection;
+    pass database_uri='sqlite:///:memory:' to load test the single shared in-memory connection instead.
+    """
+    database_path = None
+    if database_uri is None:
+        descriptor, database_path = tempfile.mkstemp(suffix='.db')
+        os.close(descriptor)
+        database_uri = 'sqlite:///' + database_path
+    # The endpoints print every request, keep that out of the report unless asked for.
+    output = sys.stdout if verbose else io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri, 'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+                              'FIRST_AVAILABLE_WORKERS': first_available_workers})
+            first_available_pool = app.extensions.get('first_available_pool')
+            with app.app_context():
+                provider_names = seed_providers(providers)
+                if first_available_pool is not None:
+                    first_available_pool.reload()
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+            server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+            server_thread.start()
+            try:
+                generator = LoadGenerator('http://127.0.0.1:{}'.format(server.server_port), provider_names,
+                                          PROFILES[profile], days, seed)
+                elapsed_seconds = generator.run(workers, requests)
+            finally:
+                server.shutdown()
+                server_thread.join()
+                if first_available_pool is not None:
+                    first_available_pool.close()
+            with app.app_context():
+                overlapping = double_bookings()
+                appointment_count = db.session.query(AppointmentModel).count()
+                db.session.remove()
+                db.get_engine(app=app).dispose()
+    finally:
+        if database_path is not None:
+            os.remove(database_path)
+    report = generator.report(elapsed_seconds)
+    report.update({'profile': profile,
+                   'workers': workers,
+                   'first_available_workers': first_available_workers,
+                   'providers': len(provider_names),
+                   'appointments_booked': appointment_count,
+                   'double_bookings': overlapping})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed')
+    parser.add_argument('--workers', type=int, default=16, help='Number of concurrent client workers')
+    parser.add_argument('--requests', type=int, default=1000, help='Total number of requests to send')
+    parser.add_argument('--providers', type=int, default=20, help='Number of extra providers to seed')
+    parser.add_argument('--days', type=int, default=5, help='Number of days, from 2023-01-02, requests span')
+    parser.add_argument('--database-uri', default=None, help='Defaults to a temporary SQLite file')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for a repeatable workload')
+    parser.add_argument('--first-available-workers', type=int, default=0,
+                        help='Serve first_available from this many worker processes, see src/sharding.py')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own output")
+    args = parser.parse_args(argv)
+    report = run_load_test(args.profile, args.workers, args.requests, args.providers, args.days,
+                           args.database_uri, args.seed, args.verbose, args.first_available_workers)
+    print(json.dumps(report, indent=2))
+    return 1 if report['double_bookings'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,7 +15,7 @@ def python_to_sql_weekday(weekday: int) -> int:
 class ProviderModel(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     first_name = db.Column(db.String)
-    last_name = db.Column(db.String, nullable=False)
+    last_name = db.Column(db.String, nullable=False, index=True)
         
     appointments = db.relationship("AppointmentModel", backref="provider_model", lazy=True, viewonly=True)
     availabilities = db.relationship("AvailabilityModel", backref="provider_model", lazy=True, viewonly=True)
@@ -40,8 +40,13 @@ class ProviderModel(db.Model):
     
     
 class AppointmentModel(db.Model):
+    # Leads with provider_id so it also serves plain provider lookups. availabilityQuery and appointments seek on
+    # (provider_id=? AND start_time<?) and the remaining end_time checks are read from the index, not the table.
+    __table_args__ = (
+        db.Index('ix_appointment_model_provider_id_start_time_end_time', 'provider_id', 'start_time', 'end_time'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('provider_model.id'), nullable=False, index=True)
+    provider_id = db.Column(db.Integer, db.ForeignKey('provider_model.id'), nullable=False)
     start_time = db.Column(db.DateTime)
     end_time = db.Column(db.DateTime)
     first_name = db.Column(db.String, nullable=False)
@@ -54,7 +59,10 @@ class AppointmentModel(db.Model):
     
     @staticmethod
     def availabilityQuery(provider_id, start_time, end_time) -> orm.Query:
+        # Both overlap cases imply the appointment starts before end_time. Spelling that out as its own bound lets
+        # SQLite seek on (provider_id, start_time) rather than test the or_ against every appointment the provider has.
         query = db.session.query(AppointmentModel) \
+            .filter(AppointmentModel.start_time < end_time) \
             .filter(or_(
                 and_(AppointmentModel.start_time <= start_time,
                      start_time < AppointmentModel.end_time),
@@ -252,8 +260,13 @@ class AppointmentModel(db.Model):
         
         
 class AvailabilityModel(db.Model):
+    # Every availability lookup is by provider and day of week, start_time and end_time make it a covering index.
+    __table_args__ = (
+        db.Index('ix_availability_model_provider_id_day_of_week_start_time', 'provider_id', 'day_of_week',
+                 'start_time', 'end_time'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('provider_model.id'), nullable=False, index=True)
+    provider_id = db.Column(db.Integer, db.ForeignKey('provider_model.id'), nullable=False)
     day_of_week = db.Column(db.Integer, nullable=False)
     start_time = db.Column(db.Time)
     end_time = db.Column(db.Time)
@@ -0,0 +1,150 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http import HTTPStatus
+from typing import Dict, List
+
+from flask import Blueprint, Flask, current_app, g, jsonify, request
+from sqlalchemy import event
+
+from src.extensions import db
+
+logger = logging.getLogger(__name__)
+
+debug = Blueprint('debug', __name__)
+
+
+def explain_query_plan(connection, statement: str, parameters) -> List[str]:
+    """
+    :return: The detail column of SQLite's EXPLAIN QUERY PLAN for the statement, one entry per plan step
+    """
+    # A fresh cursor on the DBAPI connection so any result set the caller is reading is left untouched.
+    cursor = connection.cursor()
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        # Rows are (id, parent, notused, detail)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+class Profiler:
+    """
+    Opt-in request profiler and slow-query log.
+
+    A fraction of requests (PROFILING_SAMPLE_RATE) are run under cProfile and the top functions by cumulative
+    time are kept per endpoint. Every SQL statement slower than SLOW_QUERY_THRESHOLD_MS is logged along with its
+    bound parameters and SQLite's EXPLAIN QUERY PLAN output. Everything collected is served by /debug/profiles.
+    """
+
+    def __init__(self, app: Flask = None):
+        self._lock = threading.Lock()
+        self.profiles = defaultdict(deque)
+        self.slow_queries = deque()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.1)
+        app.config.setdefault('PROFILING_MAX_PROFILES', 20)
+        app.config.setdefault('PROFILING_TOP_FUNCTIONS', 25)
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 100)
+        app.config.setdefault('SLOW_QUERY_MAX_ENTRIES', 100)
+        app.extensions['profiler'] = self
+        app.before_request(self._start_profile)
+        app.after_request(self._stop_profile)
+        # after_request is skipped when an exception propagates (TESTING, DEBUG, PROPAGATE_EXCEPTIONS), teardown is not.
+        app.teardown_request(self._stop_failed_profile)
+        app.register_blueprint(debug)
+        self.watch_engine(db.get_engine(app=app), app.config['SLOW_QUERY_THRESHOLD_MS'],
+                          app.config['SLOW_QUERY_MAX_ENTRIES'])
+
+    def watch_engine(self, engine, threshold_ms: float, max_entries: int):
+        self.slow_queries = deque(maxlen=max_entries)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed_ms = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+            if elapsed_ms < threshold_ms:
+                return
+            plan = [] if executemany else self._explain(cursor, statement, parameters)
+            entry = {'statement': statement,
+                     'parameters': [str(parameter) for parameter in parameters] if not executemany else [],
+                     'duration_ms': round(elapsed_ms, 3),
+                     'query_plan': plan}
+            logger.warning("slow query (%.1f ms): %s %s\n%s", elapsed_ms, statement, entry['parameters'],
+                           '\n'.join(plan))
+            with self._lock:
+                self.slow_queries.append(entry)
+
+    @staticmethod
+    def _explain(cursor, statement: str, parameters) -> List[str]:
+        try:
+            return explain_query_plan(cursor.connection, statement, parameters)
+        except Exception as err:
+            return ["EXPLAIN QUERY PLAN failed: {}".format(err)]
+
+    def _start_profile(self):
+        if request.blueprint == debug.name:
+            return
+        if random.random() >= current_app.config['PROFILING_SAMPLE_RATE']:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active (concurrent requests on Python 3.12+), skip this sample.
+            return
+        g.profile = profile
+        g.profile_start_time = time.perf_counter()
+
+    def _stop_profile(self, response):
+        self._record_profile(response.status_code)
+        return response
+
+    def _stop_failed_profile(self, exception):
+        # Only still set if _stop_profile never ran.
+        self._record_profile(HTTPStatus.INTERNAL_SERVER_ERROR, exception)
+
+    def _record_profile(self, status_code: int, exception: BaseException = None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        elapsed_ms = (time.perf_counter() - g.pop('profile_start_time')) * 1000
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream) \
+            .sort_stats(pstats.SortKey.CUMULATIVE) \
+            .print_stats(current_app.config['PROFILING_TOP_FUNCTIONS'])
+        entry = {'path': request.full_path,
+                 'status_code': int(status_code),
+                 'duration_ms': round(elapsed_ms, 3),
+                 'stats': stream.getvalue()}
+        if exception is not None:
+            entry['exception'] = repr(exception)
+        with self._lock:
+            # 404s and 405s never match a rule and have no endpoint, keep them together under a string key so
+            # jsonify can still sort the report.
+            profiles = self.profiles[request.endpoint or '<unmatched>']
+            profiles.append(entry)
+            while len(profiles) > current_app.config['PROFILING_MAX_PROFILES']:
+                profiles.popleft()
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {'profiles': {endpoint: list(entries) for endpoint, entries in self.profiles.items()},
+                    'slow_queries': list(self.slow_queries)}
+
+
+@debug.route('/debug/profiles', methods=['GET'])
+def profiles():
+    return jsonify(current_app.extensions['profiler'].report())
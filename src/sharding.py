@@ -0,0 +1,307 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import threading
+from bisect import bisect_right, insort
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import Flask
+
+from src.extensions import db
+from src.models import AppointmentModel, AvailabilityModel, ProviderModel, python_to_sql_weekday
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderSchedule:
+    """
+    One provider's weekly availability and booked appointments, kept sorted by start time.
+    """
+
+    def __init__(self, provider_id: int, provider_name: str):
+        self.provider_id = provider_id
+        self.provider_name = provider_name
+        self.availability = {}
+        self.appointment_starts = []
+        self.appointments = []
+        # running_until[i] is the latest end among appointments[:i + 1]. Appointments can overlap (availabilityQuery
+        # misses one nested inside another), so a long one that started earlier may outlast everything after it.
+        self.running_until = []
+
+    def add_availability(self, day_of_week, start_time, end_time):
+        insort(self.availability.setdefault(day_of_week, []), (start_time, end_time))
+
+    def add_appointment(self, start_time, end_time):
+        index = bisect_right(self.appointment_starts, start_time)
+        self.appointment_starts.insert(index, start_time)
+        self.appointments.insert(index, (start_time, end_time))
+        self.running_until.insert(index, end_time)
+        for position in range(max(index, 1), len(self.appointments)):
+            self.running_until[position] = max(self.running_until[position - 1], self.appointments[position][1])
+
+    def earliest_start(self, start_time: datetime, duration: timedelta, horizon_days: int) -> Optional[datetime]:
+        """
+        :return: The earliest time at or after start_time that fits inside an availability window without
+        overlapping an appointment, or None if there is none within horizon_days
+        """
+        for offset in range(horizon_days + 1):
+            day = start_time.date() + timedelta(days=offset)
+            for window_start, window_end in self.availability.get(python_to_sql_weekday(day.weekday()), []):
+                candidate = max(start_time, datetime.combine(day, window_start))
+                window_close = datetime.combine(day, window_end)
+                while candidate + duration <= window_close:
+                    index = bisect_right(self.appointment_starts, candidate)
+                    if index and self.running_until[index - 1] > candidate:
+                        # Something that started at or before candidate is still running.
+                        candidate = self.running_until[index - 1]
+                    elif index == len(self.appointments) or candidate + duration <= self.appointment_starts[index]:
+                        return candidate
+                    else:
+                        candidate = self.running_until[index]
+        return None
+
+
+def load_schedules(provider_id: int = None) -> Dict[int, ProviderSchedule]:
+    """
+    Reads every provider's availability and appointments from the database, or only provider_id's. Needs an app
+    context.
+    """
+    providers = db.session.query(ProviderModel)
+    availabilities = db.session.query(AvailabilityModel)
+    appointments = db.session.query(AppointmentModel).order_by(AppointmentModel.start_time)
+    if provider_id is not None:
+        providers = providers.filter(ProviderModel.id == provider_id)
+        availabilities = availabilities.filter(AvailabilityModel.provider_id == provider_id)
+        appointments = appointments.filter(AppointmentModel.provider_id == provider_id)
+    schedules = {provider.id: ProviderSchedule(provider.id, provider.last_name) for provider in providers}
+    for availability in availabilities:
+        schedules[availability.provider_id].add_availability(availability.day_of_week, availability.start_time,
+                                                             availability.end_time)
+    for appointment in appointments:
+        schedules[appointment.provider_id].add_appointment(appointment.start_time, appointment.end_time)
+    return schedules
+
+
+def earliest_candidate(schedules: Iterable[ProviderSchedule], start_time: datetime, duration: timedelta,
+                       horizon_days: int) -> Optional[Tuple[datetime, int, str]]:
+    """
+    :return: (start time, provider id, provider name) of the earliest slot across schedules, ties going to the lowest
+    provider id, or None if none of them has one within horizon_days
+    """
+    result = None
+    for schedule in schedules:
+        candidate = schedule.earliest_start(start_time, duration, horizon_days)
+        if candidate is not None and (result is None or (candidate, schedule.provider_id) < result[:2]):
+            result = (candidate, schedule.provider_id, schedule.provider_name)
+    return result
+
+
+def serve_shard(connection):
+    """
+    Worker process loop. Holds one shard of provider schedules and answers requests from ShardedFirstAvailable.
+
+    Every message is (request_id, command, *arguments) and gets a (request_id, 'ok' | 'error', result) reply. A command
+    that raises is reported back rather than ending the loop, so one bad request cannot take the shard down.
+    """
+    schedules = {}
+    while True:
+        request_id, command, *arguments = connection.recv()
+        if command == 'stop':
+            connection.close()
+            return
+        try:
+            result = None
+            if command == 'search':
+                result = earliest_candidate(schedules.values(), *arguments)
+            elif command == 'book':
+                provider_id, provider_name, start_time, end_time = arguments
+                schedules.setdefault(provider_id, ProviderSchedule(provider_id, provider_name)) \
+                    .add_appointment(start_time, end_time)
+            elif command == 'load':
+                schedules = arguments[0]
+            elif command == 'load_provider':
+                schedule = arguments[0]
+                schedules[schedule.provider_id] = schedule
+            else:
+                raise ValueError("Unknown command {!r}".format(command))
+            connection.send((request_id, 'ok', result))
+        except Exception as err:
+            connection.send((request_id, 'error', repr(err)))
+
+
+def naive(value: datetime) -> datetime:
+    # The models store naive datetimes and SQLite keeps the wall clock of aware ones, do the same here.
+    return value.replace(tzinfo=None)
+
+
+class ShardError(Exception):
+    pass
+
+
+class Shard:
+    """
+    The parent's end of one worker process. Any number of requests can be in flight at once; a reader thread hands
+    each reply to the Future waiting on its request id.
+    """
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=serve_shard, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.broken = False
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def _read_replies(self):
+        while True:
+            try:
+                request_id, status, result = self.connection.recv()
+            except (EOFError, OSError) as err:
+                self._fail_pending(ShardError("Shard worker exited: {!r}".format(err)))
+                return
+            future = self._pending.pop(request_id, None)
+            if status == 'error':
+                logger.warning("first_available shard request failed: %s", result)
+                if future is not None:
+                    future.set_exception(ShardError(result))
+            elif future is not None:
+                future.set_result(result)
+
+    def _fail_pending(self, err: Exception):
+        # Under the send lock so nothing can be queued between marking the shard broken and failing what is pending.
+        with self._send_lock:
+            self.broken = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(err)
+
+    def send(self, command: str, *arguments) -> Future:
+        future = Future()
+        with self._send_lock:
+            if self.broken:
+                future.set_exception(ShardError("Shard worker is not running"))
+                return future
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            try:
+                self.connection.send((request_id, command) + arguments)
+            except (OSError, ValueError) as err:
+                self._pending.pop(request_id, None)
+                self.broken = True
+                future.set_exception(ShardError("Shard worker is not running: {!r}".format(err)))
+        return future
+
+    def close(self):
+        with self._send_lock:
+            self.broken = True
+            try:
+                self.connection.send((None, 'stop'))
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=5)
+        self.connection.close()
+
+
+class ShardedFirstAvailable:
+    """
+    Answers first_available from provider schedules held in a pool of worker processes.
+
+    Providers are split across FIRST_AVAILABLE_WORKERS processes by id. A search is sent to every shard at once, each
+    returns its earliest candidate and the earliest of those wins, ties going to the lowest provider id. Bookings
+    are forwarded to the shard that owns the provider so shards stay warm without reloading from the database.
+    Unlike AppointmentModel.firstAvailableQuery the search looks FIRST_AVAILABLE_HORIZON_DAYS ahead rather than two.
+
+    Concurrent searches are all in flight at once, but each worker answers its queue in order, so searches run in
+    parallel across shards and one after another within a shard. If a shard fails or its worker has died the same
+    search runs in process over schedules read from the database.
+    """
+
+    def __init__(self, app: Flask = None):
+        self._shards = []
+        self._provider_ids = set()
+        self._reload_lock = threading.Lock()
+        self.horizon_days = 7
+        self.timeout_seconds = 30
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault('FIRST_AVAILABLE_HORIZON_DAYS', 7)
+        app.config.setdefault('FIRST_AVAILABLE_TIMEOUT_SECONDS', 30)
+        self.horizon_days = app.config['FIRST_AVAILABLE_HORIZON_DAYS']
+        self.timeout_seconds = app.config['FIRST_AVAILABLE_TIMEOUT_SECONDS']
+        # spawn rather than fork, the app may already be running server threads.
+        context = multiprocessing.get_context('spawn')
+        self._shards = [Shard(context) for _ in range(app.config['FIRST_AVAILABLE_WORKERS'])]
+        app.extensions['first_available_pool'] = self
+        atexit.register(self.close)
+        with app.app_context():
+            self.reload()
+
+    def _shard(self, provider_id: int) -> Shard:
+        return self._shards[provider_id % len(self._shards)]
+
+    def reload(self):
+        """
+        Replaces every shard's schedules with what is in the database. Needs an app context.
+        """
+        # book() takes the same lock, so a booking committed after the snapshot is sent after the load, never before
+        # it where the load would overwrite it. One committed before the snapshot may be applied twice, which is
+        # harmless since a duplicate blocks the same slot.
+        with self._reload_lock:
+            shards = [{} for _ in self._shards]
+            schedules = load_schedules()
+            for provider_id, schedule in schedules.items():
+                shards[provider_id % len(self._shards)][provider_id] = schedule
+            for shard, shard_schedules in zip(self._shards, shards):
+                shard.send('load', shard_schedules)
+            self._provider_ids = set(schedules)
+
+    def book(self, provider_id: int, provider_name: str, start_time: datetime, end_time: datetime):
+        """
+        Adds a booking that has already been committed. Needs an app context.
+        """
+        with self._reload_lock:
+            if provider_id not in self._provider_ids:
+                # Added after the last reload, the shard has never seen its availability either. Its schedule read
+                # now already includes this booking.
+                for schedule in load_schedules(provider_id).values():
+                    self._shard(provider_id).send('load_provider', schedule)
+                self._provider_ids.add(provider_id)
+                return
+            # Replies are only logged on error, a later search on the same shard is queued behind this anyway.
+            self._shard(provider_id).send('book', provider_id, provider_name, naive(start_time), naive(end_time))
+
+    def firstAvailable(self, start_time: datetime, duration_in_minutes: int) -> Dict:
+        """
+        Needs an app context, in case a shard fails and the search has to run here instead.
+        """
+        if not AppointmentModel.isValidSize(duration_in_minutes*60):
+            return None
+        search = (naive(start_time), timedelta(minutes=duration_in_minutes), self.horizon_days)
+        futures = [shard.send('search', *search) for shard in self._shards]
+        try:
+            # Every reply is matched to its own request id, so one failing shard leaves nothing stale on the others.
+            candidates = [future.result(timeout=self.timeout_seconds) for future in futures]
+        except Exception as err:
+            # Same search over the database rather than AppointmentModel.firstAvailable, so the answer does not depend
+            # on whether a worker is alive.
+            logger.warning("Sharded first_available failed, searching in process: %r", err)
+            candidates = [earliest_candidate(load_schedules().values(), *search)]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+        first_available, _, provider_name = min(candidates)
+        return dict(provider_name=provider_name, start_time=first_available.isoformat())
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        self._shards = []
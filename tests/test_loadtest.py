@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from src.extensions import db
+from src.loadtest import double_bookings, run_load_test
+from src.models import AppointmentModel, ProviderModel
+
+
+def test_double_bookings(app):
+    with app.app_context():
+        strange = ProviderModel.provider('strange')
+        who = ProviderModel.provider('who')
+        for provider, start_hour, end_hour in [(strange, 14, 15), (strange, 15, 16), (who, 14, 15),
+                                               (strange, 14, 15)]:
+            db.session.add(AppointmentModel(provider_id=provider.id,
+                                            start_time=datetime(2022, 12, 29, start_hour),
+                                            end_time=datetime(2022, 12, 29, end_hour),
+                                            first_name='first', last_name='last'))
+        db.session.commit()
+        overlapping = double_bookings()
+    assert len(overlapping) == 1
+    assert overlapping[0]['first']['provider_name'] == 'strange'
+    assert overlapping[0]['first']['start_time'] == '2022-12-29T14:00:00'
+
+
+def test_run_load_test():
+    report = run_load_test(profile='read-heavy', workers=4, requests=40, providers=3, seed=1)
+    assert report['requests'] == 40
+    assert report['error_rate'] == 0
+    assert set(report['operations']) <= {'appointments', 'first_available', 'book'}
+    for operation in report['operations'].values():
+        assert operation['latency_ms']['p50'] <= operation['latency_ms']['p99'] <= operation['latency_ms']['max']
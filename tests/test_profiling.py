@@ -0,0 +1,68 @@
+import sys
+from http import HTTPStatus
+
+import pytest
+
+from src.app import create_app
+from src.models import AppointmentModel
+
+
+@pytest.fixture()
+def profiled_client():
+    app = create_app({
+        "TESTING": True,
+        "PROFILING": True,
+        "PROFILING_SAMPLE_RATE": 1.0,
+        "SLOW_QUERY_THRESHOLD_MS": 0,
+    })
+    return app.test_client()
+
+
+def test_debug_route_disabled_by_default(client):
+    response = client.get('/debug/profiles')
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_profiles_and_slow_queries(profiled_client):
+    response = profiled_client.get('/appointment_model/appointments',
+                                   query_string={"provider_name": "strange",
+                                                 "start_time": "2022-12-29 1:00:00",
+                                                 "end_time": "2022-12-30 11:30:00"})
+    assert response.status_code == HTTPStatus.OK
+
+    report = profiled_client.get('/debug/profiles').json
+    profiles = report['profiles']['/.appointments']
+    assert len(profiles) == 1
+    assert profiles[0]['status_code'] == HTTPStatus.OK
+    assert 'AppointmentModel' in profiles[0]['stats'] or 'appointments' in profiles[0]['stats']
+
+    appointment_queries = [query for query in report['slow_queries']
+                           if query['statement'].startswith('SELECT appointment_model')]
+    assert appointment_queries
+    assert appointment_queries[-1]['parameters']
+    assert appointment_queries[-1]['query_plan']
+
+
+def test_profiles_unmatched_route(profiled_client):
+    assert profiled_client.get('/no/such/route').status_code == HTTPStatus.NOT_FOUND
+    assert profiled_client.get('/').status_code == HTTPStatus.OK
+
+    response = profiled_client.get('/debug/profiles')
+    assert response.status_code == HTTPStatus.OK
+    assert response.json['profiles']['<unmatched>'][0]['status_code'] == HTTPStatus.NOT_FOUND
+    assert '/.index' in response.json['profiles']
+
+
+def test_profile_stopped_when_exception_propagates(profiled_client, monkeypatch):
+    def first_available(start_time, duration_in_minutes):
+        raise AttributeError("'NoneType' object has no attribute 'provider_id'")
+    monkeypatch.setattr(AppointmentModel, 'firstAvailable', first_available)
+    # TESTING propagates the exception, so after_request never runs
+    with pytest.raises(AttributeError):
+        profiled_client.get('/appointment_model/first_available',
+                            query_string={"start_time": "2022-12-30 12:00:00", "duration": 20})
+    assert sys.getprofile() is None
+
+    profiles = profiled_client.get('/debug/profiles').json['profiles']['/.first_available']
+    assert profiles[0]['status_code'] == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert 'AttributeError' in profiles[0]['exception']
@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from http import HTTPStatus
+
+import pytest
+
+from src.app import create_app
+from src.loadtest import seed_providers
+from src.models import ProviderModel
+from src.sharding import ProviderSchedule, ShardError
+
+
+@pytest.fixture()
+def sharded_client():
+    app = create_app({
+        "TESTING": True,
+        "FIRST_AVAILABLE_WORKERS": 2,
+    })
+    yield app.test_client()
+    app.extensions['first_available_pool'].close()
+
+
+def first_available(client, start_time, duration):
+    response = client.get('/appointment_model/first_available',
+                          query_string={"start_time": start_time, "duration": duration})
+    assert response.status_code == HTTPStatus.OK
+    return response.json
+
+
+def book(client, provider_name, start_time, end_time):
+    response = client.post('/appointment_model', json={
+        'provider_name': provider_name,
+        'start_time': start_time,
+        'end_time': end_time,
+        'first_name': 'first',
+        'last_name': 'last'
+    })
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_earliest_start():
+    schedule = ProviderSchedule(1, 'strange')
+    # Thursday
+    schedule.add_availability(4, time(9), time(17))
+    schedule.add_appointment(datetime(2022, 12, 29, 9), datetime(2022, 12, 29, 10))
+    schedule.add_appointment(datetime(2022, 12, 29, 10, 20), datetime(2022, 12, 29, 11))
+    twenty_minutes = timedelta(minutes=20)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 8), twenty_minutes, 0) == datetime(2022, 12, 29, 10)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 8), timedelta(minutes=45), 0) == datetime(2022, 12, 29, 11)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 9, 30), twenty_minutes, 0) == datetime(2022, 12, 29, 10)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 16, 50), twenty_minutes, 0) is None
+    assert schedule.earliest_start(datetime(2022, 12, 29, 16, 50), twenty_minutes, 7) == datetime(2023, 1, 5, 9)
+
+
+def test_earliest_start_overlapping_appointments():
+    schedule = ProviderSchedule(2, 'who')
+    # Thursday
+    schedule.add_availability(4, time(8), time(16))
+    # Booked in this order through the API: the second contains the first
+    schedule.add_appointment(datetime(2022, 12, 29, 8, 20), datetime(2022, 12, 29, 8, 40))
+    schedule.add_appointment(datetime(2022, 12, 29, 8), datetime(2022, 12, 29, 9))
+    twenty_minutes = timedelta(minutes=20)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 8, 45), twenty_minutes, 0) == datetime(2022, 12, 29, 9)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 8), twenty_minutes, 0) == datetime(2022, 12, 29, 9)
+    # A long appointment running past several shorter ones that start after it
+    schedule.add_appointment(datetime(2022, 12, 29, 10), datetime(2022, 12, 29, 12))
+    schedule.add_appointment(datetime(2022, 12, 29, 10, 20), datetime(2022, 12, 29, 10, 40))
+    schedule.add_appointment(datetime(2022, 12, 29, 11), datetime(2022, 12, 29, 11, 20))
+    assert schedule.earliest_start(datetime(2022, 12, 29, 9, 30), twenty_minutes, 0) == datetime(2022, 12, 29, 9, 30)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 9, 30), timedelta(minutes=45), 0) == \
+        datetime(2022, 12, 29, 12)
+    assert schedule.earliest_start(datetime(2022, 12, 29, 10, 45), twenty_minutes, 0) == datetime(2022, 12, 29, 12)
+
+
+def test_sharded_first_available(sharded_client):
+    assert first_available(sharded_client, "2022-12-30 12:00:00", 20) == {
+        "start_time": "2022-12-30T12:00:00", "provider_name": "strange"}
+    assert first_available(sharded_client, "2022-12-29 7:00:00", 20) == {
+        "start_time": "2022-12-29T08:00:00", "provider_name": "who"}
+    assert first_available(sharded_client, "2022-12-29 17:00:00", 20) == {
+        "start_time": "2022-12-30T08:00:00", "provider_name": "who"}
+    assert first_available(sharded_client, "2022-12-29 7:00:00", 30) is None
+
+
+def test_sharded_first_available_after_booking(sharded_client):
+    book(sharded_client, 'who', '2022-12-29 14:00:00', '2022-12-29 15:00:00')
+    assert first_available(sharded_client, "2022-12-29 14:00:00", 20) == {
+        "start_time": "2022-12-29T14:00:00", "provider_name": "strange"}
+    book(sharded_client, 'strange', '2022-12-29 14:00:00', '2022-12-29 15:00:00')
+    book(sharded_client, 'strange', '2022-12-29 15:00:00', '2022-12-29 16:00:00')
+    assert first_available(sharded_client, "2022-12-29 14:00:00", 20) == {
+        "start_time": "2022-12-29T15:00:00", "provider_name": "who"}
+
+
+def test_sharded_first_available_timezone_aware(sharded_client):
+    expected = {"start_time": "2022-12-30T12:00:00", "provider_name": "strange"}
+    assert first_available(sharded_client, "2022-12-30T12:00:00Z", 20) == expected
+    assert first_available(sharded_client, "2022-12-30 12:00:00", 20) == expected
+
+
+def test_shard_survives_failed_command(sharded_client):
+    pool = sharded_client.application.extensions['first_available_pool']
+    for shard in pool._shards:
+        with pytest.raises(ShardError):
+            shard.send('no_such_command').result(timeout=10)
+    assert first_available(sharded_client, "2022-12-30 12:00:00", 20) == {
+        "start_time": "2022-12-30T12:00:00", "provider_name": "strange"}
+
+
+def test_booking_provider_added_after_load(sharded_client, monkeypatch):
+    app = sharded_client.application
+    pool = app.extensions['first_available_pool']
+    with app.app_context():
+        seed_providers(1)
+        provider_id = ProviderModel.provider('load_0').id
+    assert provider_id not in pool._provider_ids
+
+    def reload():
+        raise AssertionError("Only the new provider's schedule should be loaded")
+    monkeypatch.setattr(pool, 'reload', reload)
+    book(sharded_client, 'load_0', '2023-01-02 09:00:00', '2023-01-02 10:00:00')
+    assert provider_id in pool._provider_ids
+    book(sharded_client, 'load_0', '2023-01-02 10:00:00', '2023-01-02 11:00:00')
+    # strange (id 1) shares load_0's (id 3) shard, keep it busy until noon on Monday 2023-01-02
+    for start_hour in (9, 10, 11):
+        book(sharded_client, 'strange', '2023-01-02 {}:00:00'.format(start_hour),
+             '2023-01-02 {}:00:00'.format(start_hour + 1))
+    shard = pool._shard(provider_id)
+    assert shard.send('search', datetime(2023, 1, 2, 9), timedelta(minutes=20), 0).result(timeout=10)[:2] == \
+        (datetime(2023, 1, 2, 11), provider_id)
+
+    # A worker that does not hold the provider yet starts a schedule for it rather than failing.
+    assert pool._shard(1000).send('book', 1000, 'unknown', datetime(2023, 1, 2, 9),
+                                  datetime(2023, 1, 2, 10)).result(timeout=10) is None
+
+
+def test_concurrent_searches(sharded_client):
+    pool = sharded_client.application.extensions['first_available_pool']
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: pool.firstAvailable(datetime(2022, 12, 29, 7), 20), range(32)))
+    assert results == [{"start_time": "2022-12-29T08:00:00", "provider_name": "who"}] * 32
+
+
+def test_falls_back_to_in_process_search_when_a_worker_dies(sharded_client):
+    pool = sharded_client.application.extensions['first_available_pool']
+    pool._shards[0].process.kill()
+    pool._shards[0].process.join()
+    # The same answers as with every worker alive, see test_sharded_first_available. firstAvailableQuery would give
+    # strange at 2022-12-30T09:00:00 for the first.
+    for _ in range(2):
+        assert first_available(sharded_client, "2022-12-29 17:00:00", 20) == {
+            "start_time": "2022-12-30T08:00:00", "provider_name": "who"}
+        assert first_available(sharded_client, "2022-12-29 7:00:00", 20) == {
+            "start_time": "2022-12-29T08:00:00", "provider_name": "who"}
+        assert first_available(sharded_client, "2022-12-29 7:00:00", 30) is None